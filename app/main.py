@@ -1,16 +1,28 @@
 import os
+import asyncio
+import math
+import dataclasses
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import asynccontextmanager
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
+import numpy as np
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
 from llama_index.core import VectorStoreIndex, StorageContext
 from llama_index.core.prompts.base import PromptTemplate
+from llama_index.core.schema import QueryBundle
 from llama_index.core.settings import Settings
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryResult
 
-from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+from llama_index.embeddings.fastembed import FastEmbedEmbedding
 from llama_index.llms.google_genai import GoogleGenAI
 from llama_index.vector_stores.chroma import ChromaVectorStore
 
@@ -26,65 +38,202 @@ if not GOOGLE_API_KEY:
 CHROMA_PERSIST_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "chroma_db"))
 print(f"ChromaDB persistence directory: {os.path.abspath(CHROMA_PERSIST_DIR)}")
 
+# Must match the model used by ingest.py
+EMBED_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+
+# Questions at least this similar to a previously answered one reuse its answer
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_SIZE = 1024
+
+# Threads running the blocking embed/retrieve/LLM work for /ask
+QUERY_WORKERS = 8
+
+# Diverse questions retrieved at startup so the HNSW entry point and the upper-layer
+# neighbourhoods they reach are already in memory. Keeping chroma_db/ hot also needs
+# page cache headroom (e.g. a low vm.vfs_cache_pressure, or chroma_db/ on tmpfs).
+WARMUP_QUERIES = [
+    "How do I build a new habit?",
+    "How can I break a bad habit?",
+    "What are the four laws of behavior change?",
+    "Why do small improvements matter so much over time?",
+    "How does identity shape our habits?",
+    "How should I design my environment?",
+]
+
 
 # --- 2. FastAPI App Initialization ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Builds the per-worker state once at startup and keeps it on `app.state`,
+    so every uvicorn worker initializes deterministically before serving.
+    """
+    print("Server starting up...")
+
+    # Blocking query work runs here so concurrent /ask requests don't serialize on the event loop
+    app.state.executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS)
+    app.state.semantic_cache = SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD)
+    app.state.query_engine = build_engine()
+    print("--- Startup complete. Application is ready. ---")
+
+    yield
+
+    app.state.executor.shutdown()
+
 app = FastAPI(
     title="Persona AI",
     description="Ask questions to a persona powered by a knowledge base.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Pydantic model for the request body
 class AskRequest(BaseModel):
     question: str
 
-# --- 3. LlamaIndex Setup (Done globally on startup) ---
-query_engine = None
+class NormalizedChromaVectorStore(ChromaVectorStore):
+    """
+    ChromaVectorStore for a collection of L2-normalized embeddings indexed by
+    inner product. Query vectors are normalized so the inner product is a cosine,
+    and every result is scored by that cosine similarity.
+    """
 
-@app.on_event("startup")
-def startup_event():
-    global query_engine
-    print("Server starting up...")
+    def query(self, query: VectorStoreQuery, **kwargs) -> VectorStoreQueryResult:
+        if query.query_embedding is None:
+            return super().query(query, **kwargs)
+
+        query_vector = np.asarray(query.query_embedding, dtype=np.float32)
+        query_vector = query_vector / np.linalg.norm(query_vector)
+        query = dataclasses.replace(query, query_embedding=query_vector.tolist())
+        result = super().query(query, **kwargs)
+
+        # ChromaVectorStore reports exp(-distance), and the "ip" distance is 1 - cosine,
+        # so 1 + log(similarity) recovers the cosine similarity itself
+        if result.similarities is not None:
+            result.similarities = [1.0 + math.log(similarity) for similarity in result.similarities]
+        return result
+
+class SemanticCache:
+    """
+    In-memory LRU cache from question embeddings to answers. A question whose cosine
+    similarity to a cached question exceeds the threshold gets the cached answer.
+    """
+
+    def __init__(self, capacity: int, threshold: float):
+        self.capacity = capacity
+        self.threshold = threshold
+        self._vectors = None  # (capacity, dim) normalized embeddings, filled slot by slot
+        self._answers = OrderedDict()  # slot -> answer, least recently used first
+        self._lock = threading.Lock()  # /ask runs in a thread pool
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def get(self, embedding):
+        """Returns the cached answer for a similar question, or None."""
+        vector = self._normalize(embedding)
+        with self._lock:
+            if not self._answers:
+                return None
+            # Slots are filled in order, so the first len(self._answers) rows are in use
+            scores = self._vectors[:len(self._answers)] @ vector
+            slot = int(np.argmax(scores))
+            if scores[slot] <= self.threshold:
+                return None
+            self._answers.move_to_end(slot)
+            return self._answers[slot]
+
+    def put(self, embedding, answer: str) -> None:
+        """Caches an answer, evicting the least recently used one when full."""
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            if len(self._answers) < self.capacity:
+                slot = len(self._answers)
+            else:
+                slot, _ = self._answers.popitem(last=False)
+            self._vectors[slot] = vector
+            self._answers[slot] = answer
+
+def prefetch_files(directory: str) -> None:
+    """Asks the OS to read every file under directory into the page cache (Linux only)."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for root, _, files in os.walk(directory):
+        for name in files:
+            fd = os.open(os.path.join(root, name), os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+
+# --- 3. LlamaIndex Setup (Done once per worker on startup) ---
+def build_engine():
+    """
+    Configures the models, loads the vector store and returns a warmed-up
+    query engine with the persona prompt.
+    """
+    # Define the Persona Prompt
+    # This is the core instruction that gives the AI its personality and constraints.
+    # It is sent as the model's system instruction, so each request's prompt only
+    # carries the retrieved context and the question.
+    persona_system_prompt = (
+        "You are James Clear. Your tone is direct, motivational, and empowering. "
+        "You are known for 'The Atomic Habits'.\n\n"
+        "Answer the user's question based on the context provided. If the context does "
+        "not contain the answer, you can state that the information is not available in "
+        "the provided material."
+    )
+    qa_prompt_template = (
+        "Context: {context_str}\n"
+        "---------------------\n"
+        "Question: {query_str}\n"
+        "---------------------\n"
+        "Answer:"
+    )
+    qa_template = PromptTemplate(qa_prompt_template)
 
     # Configure global LlamaIndex settings
     print("Configuring global settings...")
-    Settings.llm = GoogleGenAI()
-    Settings.embed_model = GoogleGenAIEmbedding()
+    Settings.llm = GoogleGenAI(system_prompt=persona_system_prompt)
+    Settings.embed_model = FastEmbedEmbedding(model_name=EMBED_MODEL_NAME)
     print("LLM and embedding models configured.")
 
     # Load the existing vector store
     print("Loading vector store...")
     db = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
     chroma_collection = db.get_collection("persona_ai_collection")
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    vector_store = NormalizedChromaVectorStore(chroma_collection=chroma_collection)
     
     # Load the index from the vector store
     index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
     print("Index loaded from vector store.")
 
-    # Define the Persona Prompt
-    # This is the core instruction that gives the AI its personality and constraints.
-    persona_prompt_template = '''
-    You are James Clear. Your tone is direct, motivational, and empowering. You are known for 'The Atomic Habits'.
-    
-    Answer the user's question based on the context provided below. If the context does not contain the answer, you can state that the information is not available in the provided material.
-    
-    ---------------------
-    Context: {context_str}
-    ---------------------
-    Question: {query_str}
-    ---------------------
-    Answer:
-    '''
-    qa_template = PromptTemplate(persona_prompt_template)
-
     # Create the query engine with the custom persona prompt
     query_engine = index.as_query_engine(
         text_qa_template=qa_template,
-        similarity_top_k=3  # Retrieve top 3 most relevant chunks
+        similarity_top_k=3,  # Retrieve top 3 most relevant chunks
+        streaming=True,  # Send tokens to the client as the LLM generates them
     )
     print("Query engine created with persona prompt.")
-    print("--- Startup complete. Application is ready. ---")
+
+    # Warm up the ChromaDB files, the HNSW index and the embedding model so the
+    # first /ask doesn't pay the cold-start cost. Retrieval exercises everything
+    # except the LLM, which would cost a paid generation on every startup.
+    print("Warming up...")
+    try:
+        prefetch_files(CHROMA_PERSIST_DIR)
+        chroma_collection.get(limit=1, include=["embeddings"])
+        for question in WARMUP_QUERIES:
+            query_engine.retriever.retrieve(question)
+        print("Warmup complete.")
+    except Exception as e:
+        print(f"Warmup failed: {e}")
+
+    return query_engine
 
 
 # --- 4. Serve Static Files and Root Endpoint ---
@@ -95,27 +244,74 @@ async def read_root():
     return FileResponse("app/index.html")
 
 # --- 5. API Endpoint ---
+# Appended to a streamed answer when the LLM fails after the response has started
+STREAM_ERROR_MARKER = "\n\n[Error: the answer could not be completed.]"
+
+def stream_answer(tokens: Iterator[str], embedding, semantic_cache: SemanticCache) -> Iterator[str]:
+    """
+    Yields the answer as the LLM generates it, then caches the full answer.
+    """
+    chunks = []
+    try:
+        for chunk in tokens:
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        # Headers are already sent, so the error can only be reported in the body
+        print(f"An error occurred while streaming the answer: {e}")
+        yield STREAM_ERROR_MARKER
+        return
+
+    answer = "".join(chunks)
+    print(f"Generated answer: {answer}")
+    if answer:
+        semantic_cache.put(embedding, answer)
+
+def answer_question(query_engine, semantic_cache: SemanticCache, question: str) -> Iterator[str]:
+    """
+    Answers a question from the semantic cache or starts a streamed answer from the
+    query engine. This blocks on the embedding model, ChromaDB and the LLM, so it
+    runs in the thread pool.
+    """
+    # Embed once: the embedding is used for the cache lookup and for retrieval
+    embedding = Settings.embed_model.get_query_embedding(question)
+    answer = semantic_cache.get(embedding)
+    if answer is not None:
+        print(f"Semantic cache hit. Cached answer: {answer}")
+        return iter([answer])
+
+    # With streaming enabled, the response exposes the answer as `response.response_gen`
+    # and the source nodes in `response.source_nodes`
+    response = query_engine.query(QueryBundle(question, embedding=embedding))
+    print(f"Retrieved context: {response.source_nodes}")
+
+    # The LLM request only starts once the generator is iterated. Pull the first chunk
+    # here so auth, quota and safety errors still surface as a 500 from the route.
+    tokens = iter(response.response_gen)
+    first = next(tokens, None)
+    if first is None:
+        return stream_answer(iter([]), embedding, semantic_cache)
+    return stream_answer(chain([first], tokens), embedding, semantic_cache)
+
 @app.post("/ask")
-async def ask_question(request: AskRequest):
+async def ask_question(payload: AskRequest, request: Request):
     """
-    Receives a question, queries the knowledge base, and returns an answer
-    in the persona of the knowledge source.
+    Receives a question, queries the knowledge base, and streams back an answer
+    in the persona of the knowledge source as plain text.
     """
+    state = request.app.state
+    query_engine = getattr(state, "query_engine", None)
     if not query_engine:
         raise HTTPException(status_code=503, detail="Query engine is not available. The server may still be starting up.")
     
-    print(f"Received question: {request.question}")
+    print(f"Received question: {payload.question}")
     
     try:
-        response = query_engine.query(request.question)
-        
-        # The response object has the answer in `response.response`
-        # and the source nodes in `response.source_nodes`
-        answer = response.response
-        
-        print(f"Retrieved context: {response.source_nodes}")
-        print(f"Generated answer: {answer}")
-        return {"answer": answer}
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(
+            state.executor, answer_question, query_engine, state.semantic_cache, payload.question
+        )
+        return StreamingResponse(chunks, media_type="text/plain")
 
     except Exception as e:
         print(f"An error occurred while querying: {e}")
@@ -125,3 +321,4 @@ async def ask_question(request: AskRequest):
 # 1. Make sure you are in the `persona-ai` directory.
 # 2. Run the command: `source .venv/bin/activate`
 # 3. Run the command: `uvicorn app.main:app --reload`
+#    For production, drop `--reload` and add `--workers 4`; uvicorn uses uvloop when it is installed.
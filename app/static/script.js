@@ -34,8 +34,17 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(errorData.detail || 'An unknown error occurred.');
             }
 
-            const data = await response.json();
-            answerDiv.textContent = data.answer;
+            // The answer is streamed as plain text; show it as it arrives
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) {
+                    break;
+                }
+                answerDiv.textContent += decoder.decode(value, { stream: true });
+            }
+            answerDiv.textContent += decoder.decode();
 
         } catch (error) {
             answerDiv.textContent = `Error: ${error.message}`;
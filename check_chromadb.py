@@ -9,15 +9,15 @@ def main():
     db = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
     collection = db.get_collection(COLLECTION_NAME)
     
-    # Get all documents with their content
-    docs = collection.get(include=["documents"])
+    # Count the documents without loading them, then fetch only the ones we print
+    num_docs = collection.count()
+    docs = collection.get(limit=10, include=["documents"])
     
     if docs and docs["documents"]:
-        num_docs = len(docs["documents"])
         print(f"Found {num_docs} documents in collection '{COLLECTION_NAME}'.")
         
         # Print the first 10 documents for inspection
-        for i, doc in enumerate(docs["documents"][:10]):
+        for i, doc in enumerate(docs["documents"]):
             print(f"--- Document {i+1} (first 500 chars) ---")
             print(doc[:500])
             print("\n")
@@ -1,34 +1,83 @@
 import os
+from blake3 import blake3
+from diskcache import Cache
 from dotenv import load_dotenv
+import numpy as np
 from llama_index.core import (
     VectorStoreIndex,
     SimpleDirectoryReader,
     StorageContext,
 )
 from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
 from llama_index.core.settings import Settings
-from llama_index.core.ingestion import IngestionPipeline
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+from llama_index.embeddings.fastembed import FastEmbedEmbedding
 import chromadb
 
 # Load environment variables from a .env file
 load_dotenv()
 
 # --- Configuration ---
-# Ensure your Google API Key is set in a .env file
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
-    print("Warning: GOOGLE_API_KEY environment variable not set. Using a placeholder.")
-    GOOGLE_API_KEY = "placeholder"
-
 # Define paths for data and persistent storage
 DATA_DIR = "data"
 CHROMA_PERSIST_DIR = "./chroma_db"
 COLLECTION_NAME = "persona_ai_collection"
+EMBED_CACHE_DIR = "./embedding_cache"
+
+# HNSW index settings for the collection. For corpora above ~100k chunks, raise hnsw:M to 32.
+# Embeddings are L2-normalized before they are stored, so inner product equals cosine.
+HNSW_CONFIG = {
+    "hnsw:space": "ip",
+    "hnsw:M": 16,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+}
+
+# Local embedding model, run through FastEmbed's ONNX runtime
+EMBED_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+# Chunking. bge-small-en-v1.5 truncates inputs past 512 tokens, so larger chunks
+# would lose their tail; a small overlap keeps redundant embedding work down.
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 25
+# Number of chunks passed to the embedding model per call. Batches run one at a time:
+# ONNX Runtime already spreads each call across every CPU core.
+EMBED_BATCH_SIZE = 100
+# Rows written to ChromaDB per add() call (one sqlite transaction each)
+CHROMA_ADD_BATCH_SIZE = 5000
 
 print(f"Data directory: {os.path.abspath(DATA_DIR)}")
 print(f"ChromaDB persistence directory: {os.path.abspath(CHROMA_PERSIST_DIR)}")
+print(f"Embedding cache directory: {os.path.abspath(EMBED_CACHE_DIR)}")
+
+def cached_embed(embed_model, texts, cache):
+    """
+    Embeds texts, reusing embeddings from the on-disk cache for any chunk that
+    was embedded before. Keys are Blake3 hashes of the model name and chunk text,
+    so only new or changed chunks are sent to the embedding model.
+    """
+    keys = [blake3(f"{embed_model.model_name}\n{text}".encode()).hexdigest() for text in texts]
+    embeddings = [cache.get(key) for key in keys]
+    misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    print(f"Embedding cache: {len(texts) - len(misses)} hits, {len(misses)} misses.")
+
+    if misses:
+        new_embeddings = embed_model.get_text_embedding_batch(
+            [texts[i] for i in misses], show_progress=True
+        )
+        with cache.transact():
+            for i, embedding in zip(misses, new_embeddings):
+                cache.set(keys[i], embedding)
+                embeddings[i] = embedding
+    return embeddings
+
+def normalize(vectors):
+    """
+    L2-normalizes each row, so cosine similarity becomes a plain dot product.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
 
 def main():
     """
@@ -40,13 +89,15 @@ def main():
     db = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
     
     # 2. Clear out the old collection if it exists
-    print(f"Checking for existing collection: {COLLECTION_NAME}")
-    if COLLECTION_NAME in [c.name for c in db.list_collections()]:
-        print(f"Deleting existing collection: {COLLECTION_NAME}")
+    # Deleting directly avoids listing every collection just to check for this one
+    try:
         db.delete_collection(name=COLLECTION_NAME)
+        print(f"Deleted existing collection: {COLLECTION_NAME}")
+    except (ValueError, chromadb.errors.NotFoundError):
+        print(f"No existing collection named: {COLLECTION_NAME}")
     
     # Create a new collection
-    chroma_collection = db.get_or_create_collection(COLLECTION_NAME)
+    chroma_collection = db.get_or_create_collection(COLLECTION_NAME, metadata=HNSW_CONFIG)
     print(f"ChromaDB collection '{COLLECTION_NAME}' created/reset.")
 
     # 3. Load documents
@@ -61,25 +112,47 @@ def main():
         return
 
     # 4. Set up the embedding model and global settings
-    Settings.embed_model = GoogleGenAIEmbedding()
-    print("Gemini embedding model initialized.")
-
-    # 5. Define and run the ingestion pipeline
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    
-    pipeline = IngestionPipeline(
-        transformations=[
-            SentenceSplitter(chunk_size=512, chunk_overlap=50),
-            Settings.embed_model,
-        ],
-        vector_store=vector_store,
+    # A single instance is reused for every embedding call; loading the ONNX model is expensive
+    embed_model = FastEmbedEmbedding(
+        model_name=EMBED_MODEL_NAME, embed_batch_size=EMBED_BATCH_SIZE
     )
-    
-    print("Running ingestion pipeline... (This may take a while)")
-    # This will process documents, split them, embed them, and store them.
-    pipeline.run(documents=documents, show_progress=True)
+    Settings.embed_model = embed_model
+    print(f"Local embedding model '{EMBED_MODEL_NAME}' initialized.")
+
+    # 5. Split the documents into chunks
+    splitter = SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    nodes = splitter.get_nodes_from_documents(documents, show_progress=True)
+    print(f"Split documents into {len(nodes)} chunks.")
+
+    # 6. Embed the chunks in batches rather than one call per chunk
+    print("Embedding chunks... (This may take a while)")
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    with Cache(EMBED_CACHE_DIR) as cache:
+        embeddings = cached_embed(embed_model, texts, cache)
+    print(f"Embedded {len(embeddings)} chunks.")
+    vectors = normalize(np.asarray(embeddings, dtype=np.float32))
+
+    # 7. Store the precomputed embeddings directly in ChromaDB, in large batches so
+    # each sqlite transaction covers thousands of rows.
+    # The metadata layout matches ChromaVectorStore so the app can rebuild the nodes.
+    ids = [node.node_id for node in nodes]
+    documents = [node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes]
+    metadatas = [
+        node_to_metadata_dict(node, remove_text=True, flat_metadata=True)
+        for node in nodes
+    ]
+    # ChromaDB rejects batches above its own limit
+    add_batch_size = min(CHROMA_ADD_BATCH_SIZE, db.get_max_batch_size())
+    for start in range(0, len(ids), add_batch_size):
+        end = start + add_batch_size
+        chroma_collection.add(
+            ids=ids[start:end],
+            embeddings=vectors[start:end],
+            documents=documents[start:end],
+            metadatas=metadatas[start:end],
+        )
 
-    # 6. Verification
+    # 8. Verification
     num_nodes = len(chroma_collection.get()["ids"])
     print("--------------------------------------------------")
     print("Ingestion complete!")